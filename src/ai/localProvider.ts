@@ -1,4 +1,5 @@
-import { exec } from 'child_process';
+import { exec, spawn, ChildProcessWithoutNullStreams } from 'child_process';
+import readline from 'readline';
 import { promisify } from 'util';
 import path from 'path';
 import fs from 'fs/promises';
@@ -16,6 +17,220 @@ export enum LocalModelType {
     Llama = 'llama'
 }
 
+// Long-lived Python worker that keeps the model loaded between requests
+interface WorkerRequest {
+    operation: string;
+    text: string;
+    resolve: (result: any) => void;
+    reject: (error: Error) => void;
+}
+
+interface PythonWorker {
+    process: ChildProcessWithoutNullStreams;
+    modelName: string;
+    nextId: number;
+    ready: boolean;
+    // The worker handles one request at a time, so requests wait here and
+    // are only written to stdin once the previous one has been answered
+    queue: WorkerRequest[];
+    inFlight: { id: number; request: WorkerRequest } | null;
+    timer: NodeJS.Timeout | null;
+}
+
+let pythonWorker: PythonWorker | null = null;
+
+// Model load (and a possible download or compile warmup) must finish within this time
+const WORKER_STARTUP_TIMEOUT_MS = 15 * 60 * 1000;
+
+// The request being processed must be answered within this time
+const WORKER_REQUEST_TIMEOUT_MS = 5 * 60 * 1000;
+
+function armWorkerTimer(worker: PythonWorker, timeoutMs: number, onTimeout: () => void): void {
+    if (worker.timer) {
+        clearTimeout(worker.timer);
+    }
+    worker.timer = setTimeout(onTimeout, timeoutMs);
+}
+
+// Detach the worker, fail its outstanding requests and make sure it is gone
+function stopPythonWorker(worker: PythonWorker, error: Error): void {
+    if (pythonWorker === worker) {
+        pythonWorker = null;
+    }
+
+    if (worker.timer) {
+        clearTimeout(worker.timer);
+        worker.timer = null;
+    }
+
+    const requests = worker.inFlight ? [worker.inFlight.request, ...worker.queue] : worker.queue;
+    worker.inFlight = null;
+    worker.queue = [];
+    for (const request of requests) {
+        request.reject(error);
+    }
+
+    if (worker.process.exitCode === null && !worker.process.killed) {
+        worker.process.kill();
+    }
+}
+
+// Send the next queued request once the worker is ready and idle
+function sendNextRequest(worker: PythonWorker): void {
+    if (!worker.ready || worker.inFlight || worker.queue.length === 0) {
+        return;
+    }
+
+    const request = worker.queue.shift()!;
+    const id = worker.nextId++;
+    worker.inFlight = { id, request };
+
+    // Only the request actually being processed is timed
+    armWorkerTimer(worker, WORKER_REQUEST_TIMEOUT_MS, () => {
+        logger.error(`Python worker request ${id} timed out after ${WORKER_REQUEST_TIMEOUT_MS}ms, restarting worker`);
+
+        // Fail the hung request but hand the waiting ones to a fresh worker
+        const waiting = worker.queue;
+        worker.queue = [];
+        stopPythonWorker(worker, new Error(`Python worker request ${id} timed out`));
+
+        if (waiting.length > 0) {
+            const replacement = getPythonWorker(worker.modelName);
+            replacement.queue.push(...waiting);
+            sendNextRequest(replacement);
+        }
+    });
+
+    worker.process.stdin.write(JSON.stringify({ id, operation: request.operation, text: request.text }) + '\n');
+}
+
+function handleWorkerLine(worker: PythonWorker, line: string): void {
+    let response;
+    try {
+        response = JSON.parse(line);
+    } catch (e) {
+        logger.debug(`Python worker stdout: ${line}`);
+        return;
+    }
+
+    if (response.ready) {
+        logger.debug('Python worker ready');
+        worker.ready = true;
+        if (worker.timer) {
+            clearTimeout(worker.timer);
+            worker.timer = null;
+        }
+        sendNextRequest(worker);
+        return;
+    }
+
+    if (!worker.inFlight || worker.inFlight.id !== response.id) {
+        return;
+    }
+
+    const { request } = worker.inFlight;
+    worker.inFlight = null;
+    if (worker.timer) {
+        clearTimeout(worker.timer);
+        worker.timer = null;
+    }
+
+    if (response.error) {
+        request.reject(new Error(response.error));
+    } else {
+        request.resolve(response.result);
+    }
+
+    sendNextRequest(worker);
+}
+
+function getPythonWorker(modelName: string): PythonWorker {
+    if (pythonWorker && pythonWorker.modelName === modelName) {
+        return pythonWorker;
+    }
+
+    // Model changed, replace the running worker
+    if (pythonWorker) {
+        stopPythonWorker(pythonWorker, new Error('Python worker replaced for a different model'));
+    }
+
+    const config = loadConfig();
+    const pythonPath = config.ai.localModelConfig?.pythonPath || 'python';
+    const scriptPath = path.join(__dirname, 'python', 'deepseek_service.py');
+
+    const args = [scriptPath, '--serve'];
+    if (modelName) {
+        args.push('--model', modelName);
+    }
+
+    const worker: PythonWorker = {
+        process: spawn(pythonPath, args),
+        modelName,
+        nextId: 0,
+        ready: false,
+        queue: [],
+        inFlight: null,
+        timer: null
+    };
+
+    // Nothing is sent until the worker reports that its model is loaded
+    armWorkerTimer(worker, WORKER_STARTUP_TIMEOUT_MS, () => {
+        logger.error(`Python worker did not become ready within ${WORKER_STARTUP_TIMEOUT_MS}ms`);
+        stopPythonWorker(worker, new Error('Python worker startup timed out'));
+    });
+
+    // One JSON message per line on stdout
+    readline.createInterface({ input: worker.process.stdout }).on('line', (line) => {
+        handleWorkerLine(worker, line);
+    });
+
+    worker.process.stderr.on('data', (data) => {
+        logger.debug(`Python worker stderr: ${data}`);
+    });
+
+    const handleExit = (error: Error) => stopPythonWorker(worker, error);
+
+    // Writing to a worker that already died raises EPIPE on stdin
+    worker.process.stdin.on('error', handleExit);
+    worker.process.on('error', handleExit);
+    worker.process.on('exit', (code) => {
+        logger.debug(`Python worker exited with code ${code}`);
+        handleExit(new Error(`Python worker exited with code ${code}`));
+    });
+
+    pythonWorker = worker;
+    return worker;
+}
+
+// Send a single operation to the persistent worker
+function callPythonWorker(operation: string, text: string, modelName: string): Promise<any> {
+    return new Promise((resolve, reject) => {
+        const worker = getPythonWorker(modelName);
+        worker.queue.push({ operation, text, resolve, reject });
+        sendNextRequest(worker);
+    });
+}
+
+// Run an operation on the worker, falling back to a one-shot script run
+async function runLocalOperation(operation: string, text: string, modelName: string): Promise<any> {
+    try {
+        return await callPythonWorker(operation, text, modelName);
+    } catch (error) {
+        logger.error('Python worker request failed, falling back to one-shot script:', error);
+
+        const args = [
+            '--operation', operation,
+            '--input', text
+        ];
+
+        if (modelName) {
+            args.push('--model', modelName);
+        }
+
+        return runPythonScript(args);
+    }
+}
+
 // Function to run Python script with retries
 async function runPythonScript(args: string[], retries = 2): Promise<any> {
     const config = loadConfig();
@@ -109,16 +324,7 @@ export async function getLocalSummary(text: string): Promise<DocumentSummary> {
     const perfEnd = performance.start('local-model-summary');
 
     try {
-        const args = [
-            '--operation', 'summarize',
-            '--input', text
-        ];
-
-        if (modelName) {
-            args.push('--model', modelName);
-        }
-
-        const result = await runPythonScript(args);
+        const result = await runLocalOperation('summarize', text, modelName);
 
         logger.debug(`Local model summary generated in ${perfEnd()}ms`);
 
@@ -148,16 +354,7 @@ export async function getLocalAnalysis(text: string): Promise<DocumentAnalysis>
     const perfEnd = performance.start('local-model-analysis');
 
     try {
-        const args = [
-            '--operation', 'analyze',
-            '--input', text
-        ];
-
-        if (modelName) {
-            args.push('--model', modelName);
-        }
-
-        const result = await runPythonScript(args);
+        const result = await runLocalOperation('analyze', text, modelName);
 
         logger.debug(`Local model analysis generated in ${perfEnd()}ms`);
 
@@ -191,16 +388,7 @@ export async function getLocalTags(text: string): Promise<string[]> {
     const perfEnd = performance.start('local-model-tags');
 
     try {
-        const args = [
-            '--operation', 'tags',
-            '--input', text
-        ];
-
-        if (modelName) {
-            args.push('--model', modelName);
-        }
-
-        const result = await runPythonScript(args);
+        const result = await runLocalOperation('tags', text, modelName);
 
         logger.debug(`Local model tags generated in ${perfEnd()}ms`);
 
@@ -1,72 +1,308 @@
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import (AutoModelForCausalLM, AutoTokenizer, CompileConfig, StaticCache,
+                          StoppingCriteria, StoppingCriteriaList)
 import argparse
+import importlib.util
 import json
+import os
 import sys
 
+DEFAULT_BATCH_SIZE = 8
+# KV cache length is rounded up to a multiple of this so one preallocated
+# cache can be reused across prompts of similar length
+CACHE_LEN_STEP = 256
+# Largest generation budget of any operation; compiled runs size every
+# cache for it so all operations share the same cache shapes
+MAX_NEW_TOKENS = 800
+# Prompt length (in tokens) the compiled model is warmed up at
+WARMUP_PROMPT_LEN = 1024
+QUANTIZATION_MODES = ['none', 'int8', 'fp8']
+JSON_BRACKETS = {'object': ('{', '}'), 'array': ('[', ']')}
+
+
+class JsonBalanceStop(StoppingCriteria):
+    """Stop each row once the first top-level JSON object/array it emits closes"""
+    
+    def __init__(self, tokenizer, start, batch_size, kind='object'):
+        self.tokenizer = tokenizer
+        self.seen = start
+        self.open_char, self.close_char = JSON_BRACKETS[kind]
+        self.depth = [0] * batch_size
+        self.in_string = [False] * batch_size
+        self.escaped = [False] * batch_size
+        self.done = [False] * batch_size
+    
+    def __call__(self, input_ids, scores, **kwargs):
+        # Only scan the tokens added since the last call
+        new_tokens = input_ids[:, self.seen:].tolist()
+        self.seen = input_ids.shape[1]
+        
+        for row, tokens in enumerate(new_tokens):
+            if not self.done[row]:
+                self._scan(row, self.tokenizer.decode(tokens, skip_special_tokens=True))
+        
+        return torch.tensor(self.done, dtype=torch.bool, device=input_ids.device)
+    
+    def _scan(self, row, text):
+        for char in text:
+            if self.in_string[row]:
+                if self.escaped[row]:
+                    self.escaped[row] = False
+                elif char == '\\':
+                    self.escaped[row] = True
+                elif char == '"':
+                    self.in_string[row] = False
+            elif char == '"' and self.depth[row] > 0:
+                self.in_string[row] = True
+            elif char == self.open_char:
+                self.depth[row] += 1
+            elif char == self.close_char and self.depth[row] > 0:
+                self.depth[row] -= 1
+                if self.depth[row] == 0:
+                    self.done[row] = True
+                    return
+
+
 class DeepSeekService:
-    def __init__(self, model_name="deepseek-ai/deepseek-coder-1.3b-instruct"):
+    def __init__(self, model_name="deepseek-ai/deepseek-coder-1.3b-instruct", quantization="none",
+                 compile=False, warmup_batch_size=1):
+        if quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"Unsupported quantization mode: {quantization}")
         self.model_name = model_name
+        self.quantization = quantization
+        self.compile = compile
+        self.warmup_batch_size = warmup_batch_size
         self.tokenizer = None
         self.model = None
+        self.cache = None
+        self.cache_batch_size = 0
+        self.cache_len = 0
         print(f"Initializing DeepSeek model: {model_name}", file=sys.stderr)
     
     def load_model(self):
         # Load model & tokenizer
         print("Loading tokenizer and model...", file=sys.stderr)
         self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
-        self.model = AutoModelForCausalLM.from_pretrained(self.model_name, device_map="auto")
-        print("Model loaded successfully", file=sys.stderr)
+        attn_implementation = self.attention_implementation()
+        load_kwargs = {"device_map": "auto", "attn_implementation": attn_implementation}
+        torch_dtype = self.torch_dtype()
+        if torch_dtype is not None:
+            load_kwargs["torch_dtype"] = torch_dtype
+        if self.quantization == "int8":
+            # W8 weight-only: halves the weight bytes streamed per decode step
+            from transformers import BitsAndBytesConfig
+            load_kwargs["quantization_config"] = BitsAndBytesConfig(load_in_8bit=True, llm_int8_threshold=6.0)
+        
+        self.model = AutoModelForCausalLM.from_pretrained(self.model_name, **load_kwargs)
+        
+        if self.quantization == "fp8":
+            self.quantize_fp8()
+        
+        self.cache = None
+        print(f"Model loaded successfully ({attn_implementation} attention)", file=sys.stderr)
+        
+        if self.compile:
+            self.compile_model()
+    
+    def compile_model(self):
+        # generate() compiles the decoding step itself when it is handed a
+        # StaticCache; configure that compilation rather than wrapping forward
+        if torch.__version__ < "2.4":
+            print(f"torch.compile needs torch>=2.4 (found {torch.__version__}), skipping", file=sys.stderr)
+            self.compile = False
+            return
+        
+        self.model.generation_config.compile_config = CompileConfig(
+            fullgraph=True, dynamic=False, mode="reduce-overhead"
+        )
+        
+        # Compiled decode graphs are specific to (batch size, cache length).
+        # Warming up at WARMUP_PROMPT_LEN allocates a cache that later prompts
+        # up to that length reuse, so they replay these graphs; longer prompts
+        # or other batch sizes allocate a new cache and compile on first use
+        filler_ids = self.tokenizer(" document", add_special_tokens=False)["input_ids"]
+        warmup_prompt = " document" * max(1, (WARMUP_PROMPT_LEN - 1) // len(filler_ids))
+        print(f"Warming up compiled model at batch size {self.warmup_batch_size}, "
+              f"{WARMUP_PROMPT_LEN}-token prompts...", file=sys.stderr)
+        self.generate_batch([warmup_prompt] * self.warmup_batch_size, max_tokens=MAX_NEW_TOKENS)
+        print("Model compiled", file=sys.stderr)
+    
+    def torch_dtype(self):
+        # Half-precision weights on GPU halve the bytes streamed per decode step
+        # (and FlashAttention-2 requires them); keep the fp32 default on CPU
+        if not torch.cuda.is_available():
+            return None
+        return torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+    
+    def attention_implementation(self):
+        # Prefer FlashAttention-2 when installed on a GPU, otherwise PyTorch's
+        # fused scaled_dot_product_attention instead of the eager kernel.
+        # FA2 only works with the StaticCache from transformers 4.48 on
+        if torch.cuda.is_available() and importlib.util.find_spec("flash_attn") is not None:
+            return "flash_attention_2"
+        return "sdpa"
+    
+    def quantize_fp8(self):
+        # FP8 matmuls need Ada/Hopper (compute capability 8.9+), e.g. L40S/H100
+        if not torch.cuda.is_available() or torch.cuda.get_device_capability() < (8, 9):
+            print("FP8 quantization requires an SM 8.9+ GPU, keeping original weights", file=sys.stderr)
+            return
+        
+        from torchao.quantization import quantize_, float8_dynamic_activation_float8_weight
+        quantize_(self.model, float8_dynamic_activation_float8_weight())
+        print("Model quantized to FP8", file=sys.stderr)
+    
+    def get_cache(self, batch_size, max_cache_len):
+        # Reuse the preallocated KV cache when its shape matches this request,
+        # otherwise allocate one sized for prompt + generated tokens
+        max_cache_len = -(-max_cache_len // CACHE_LEN_STEP) * CACHE_LEN_STEP
+        if self.cache is not None and self.cache_batch_size == batch_size:
+            # Attention runs over the whole cache length, so outside of compiled
+            # decoding a larger cache only costs time and memory. A compiled
+            # graph is specialised on the cache shape, so there keeping the
+            # larger cache avoids recompiling.
+            if self.cache_len == max_cache_len or (self.compile and self.cache_len > max_cache_len):
+                self.cache.reset()
+                return self.cache
+        
+        # Drop the old cache first so both are never held at once
+        self.cache = None
+        
+        # Track the shape ourselves; StaticCache's own attributes for it have
+        # been renamed across transformers releases
+        self.cache_batch_size = batch_size
+        self.cache_len = max_cache_len
+        self.cache = StaticCache(
+            config=self.model.config,
+            max_batch_size=batch_size,
+            max_cache_len=max_cache_len,
+            device=self.model.device,
+            dtype=self.model.dtype
+        )
+        return self.cache
+    
+    def generate(self, prompt, max_tokens=500, temperature=0.7, top_p=0.9, stop_on=None, deterministic=True):
+        return self.generate_batch([prompt], max_tokens, temperature, top_p, stop_on, deterministic)[0]
     
-    def generate(self, prompt, max_tokens=500, temperature=0.7, top_p=0.9):
+    def generate_batch(self, prompts, max_tokens=500, temperature=0.7, top_p=0.9, stop_on=None,
+                       deterministic=True):
         if not self.model or not self.tokenizer:
             self.load_model()
-            
-        # Tokenize input with attention mask
-        inputs = self.tokenizer(prompt, return_tensors="pt", padding=True, truncation=True)
-        attention_mask = inputs["attention_mask"]  # Ensuring attention mask is present
         
-        # Generate response with explicit attention mask
+        # Left-pad so every row's prompt ends at the same position and the
+        # generated tokens line up in the output tensor
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        
+        # Tokenize input with attention mask. When compiling, pad prompts to a
+        # CACHE_LEN_STEP bucket and reserve the full generation budget so the
+        # number of distinct cache shapes (and graph captures) stays small
+        pad_to_multiple_of = CACHE_LEN_STEP if self.compile else None
+        inputs = self.tokenizer(prompts, return_tensors="pt", padding=True, truncation=True,
+                                pad_to_multiple_of=pad_to_multiple_of)
+        input_ids = inputs["input_ids"].to(self.model.device)
+        attention_mask = inputs["attention_mask"].to(self.model.device)
+        
+        cache_tokens = max(max_tokens, MAX_NEW_TOKENS) if self.compile else max_tokens
+        cache = self.get_cache(input_ids.shape[0], input_ids.shape[1] + cache_tokens)
+        
+        # Stop decoding as soon as the JSON object/array in each row is closed
+        stopping_criteria = None
+        if stop_on:
+            stopping_criteria = StoppingCriteriaList([
+                JsonBalanceStop(self.tokenizer, input_ids.shape[1], input_ids.shape[0], kind=stop_on)
+            ])
+        
+        # Greedy decoding for structured output, otherwise temperature + top-p sampling
+        if deterministic:
+            sampling = {"do_sample": False, "temperature": None, "top_p": None, "num_beams": 1}
+        else:
+            sampling = {"do_sample": True, "temperature": temperature, "top_p": top_p}
+        
+        # Generate responses for the whole batch in a single call
         with torch.no_grad():
             outputs = self.model.generate(
-                input_ids=inputs["input_ids"],
+                input_ids=input_ids,
                 attention_mask=attention_mask,
+                past_key_values=cache,
+                use_cache=True,
                 max_new_tokens=max_tokens,
-                do_sample=True,
-                temperature=temperature,
-                top_p=top_p
+                stopping_criteria=stopping_criteria,
+                eos_token_id=self.eos_token_ids(),
+                pad_token_id=self.tokenizer.pad_token_id,
+                disable_compile=not self.compile,
+                **sampling
             )
         
-        # Decode output
-        response = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-        return response.replace(prompt, "").strip()
+        # Decode only the newly generated tokens of each row
+        responses = self.tokenizer.batch_decode(outputs[:, input_ids.shape[1]:], skip_special_tokens=True)
+        return [response.strip() for response in responses]
+    
+    def eos_token_ids(self):
+        # Stop on the tokenizer's EOS as well as any the generation config defines
+        eos_ids = self.model.generation_config.eos_token_id
+        eos_ids = list(eos_ids) if isinstance(eos_ids, (list, tuple)) else [eos_ids]
+        if self.tokenizer.eos_token_id is not None:
+            eos_ids.append(self.tokenizer.eos_token_id)
+        return sorted({eos_id for eos_id in eos_ids if eos_id is not None})
     
     def summarize(self, text):
-        prompt = f"""Please summarize the following document and provide 3-5 key points. Format your response as JSON with fields 'summary' and 'keyPoints' as an array.
+        return self.summarize_batch([text])[0]
+    
+    def summarize_batch(self, texts, batch_size=DEFAULT_BATCH_SIZE):
+        return self._run_batch(texts, summary_prompt, parse_summary, MAX_NEW_TOKENS, batch_size, 'object')
+    
+    def analyze(self, text):
+        return self.analyze_batch([text])[0]
+    
+    def analyze_batch(self, texts, batch_size=DEFAULT_BATCH_SIZE):
+        return self._run_batch(texts, analysis_prompt, parse_analysis, MAX_NEW_TOKENS, batch_size, 'object')
+    
+    def generate_tags(self, text):
+        return self.generate_tags_batch([text])[0]
+    
+    def generate_tags_batch(self, texts, batch_size=DEFAULT_BATCH_SIZE):
+        return self._run_batch(texts, tags_prompt, parse_tags, 300, batch_size, 'array')
+    
+    def _run_batch(self, texts, build_prompt, parse, max_tokens, batch_size, stop_on=None):
+        # Run the prompts through the model batch_size rows per forward pass
+        batch_size = max(1, batch_size)
+        results = []
+        for start in range(0, len(texts), batch_size):
+            prompts = [build_prompt(text) for text in texts[start:start + batch_size]]
+            responses = self.generate_batch(prompts, max_tokens=max_tokens, stop_on=stop_on, deterministic=True)
+            results.extend(parse(response) for response in responses)
+        return results
+
+
+def summary_prompt(text):
+    return f"""Please summarize the following document and provide 3-5 key points. Format your response as JSON with fields 'summary' and 'keyPoints' as an array.
 
 Document content:
 {text}
 
 Response:"""
-        
-        response = self.generate(prompt, max_tokens=800)
-        
-        try:
-            # Try to extract JSON from the response
-            json_start = response.find("{")
-            json_end = response.rfind("}") + 1
-            if json_start >= 0 and json_end > json_start:
-                json_text = response[json_start:json_end]
-                result = json.loads(json_text)
-                return result
-            else:
-                # Fallback for non-JSON response
-                return {"summary": response, "keyPoints": []}
-        except json.JSONDecodeError:
+
+
+def parse_summary(response):
+    try:
+        # Try to extract JSON from the response
+        json_start = response.find("{")
+        json_end = response.rfind("}") + 1
+        if json_start >= 0 and json_end > json_start:
+            json_text = response[json_start:json_end]
+            result = json.loads(json_text)
+            return result
+        else:
+            # Fallback for non-JSON response
             return {"summary": response, "keyPoints": []}
-    
-    def analyze(self, text):
-        prompt = f"""Analyze this document and provide:
+    except json.JSONDecodeError:
+        return {"summary": response, "keyPoints": []}
+
+
+def analysis_prompt(text):
+    return f"""Analyze this document and provide:
 1. Up to 5 main topics
 2. Key entities (people, organizations, locations) with their importance (0-10)
 3. Overall sentiment (score from -1 to 1, and label)
@@ -78,45 +314,46 @@ Document:
 {text}
 
 Response:"""
-        
-        response = self.generate(prompt, max_tokens=800)
-        
-        try:
-            # Try to extract JSON
-            json_start = response.find("{")
-            json_end = response.rfind("}") + 1
-            if json_start >= 0 and json_end > json_start:
-                json_text = response[json_start:json_end]
-                return json.loads(json_text)
-            else:
-                return default_analysis_result()
-        except json.JSONDecodeError:
+
+
+def parse_analysis(response):
+    try:
+        # Try to extract JSON
+        json_start = response.find("{")
+        json_end = response.rfind("}") + 1
+        if json_start >= 0 and json_end > json_start:
+            json_text = response[json_start:json_end]
+            return json.loads(json_text)
+        else:
             return default_analysis_result()
-    
-    def generate_tags(self, text):
-        prompt = f"""Generate 5-10 relevant tags for this document. Return them as a JSON array of strings. Tags should be short (1-2 words) and descriptive.
+    except json.JSONDecodeError:
+        return default_analysis_result()
+
+
+def tags_prompt(text):
+    return f"""Generate 5-10 relevant tags for this document. Return them as a JSON array of strings. Tags should be short (1-2 words) and descriptive.
 
 Document:
 {text}
 
 Response:"""
-        
-        response = self.generate(prompt, max_tokens=300)
-        
-        try:
-            # Try to extract JSON array
-            json_start = response.find("[")
-            json_end = response.rfind("]") + 1
-            if json_start >= 0 and json_end > json_start:
-                json_text = response[json_start:json_end]
-                tags = json.loads(json_text)
-                return tags if isinstance(tags, list) else []
-            else:
-                # Fallback: extract words that look like tags
-                words = [word.strip() for word in response.split() if len(word) > 3]
-                return words[:10]  # Return up to 10 words as tags
-        except json.JSONDecodeError:
-            return []
+
+
+def parse_tags(response):
+    try:
+        # Try to extract JSON array
+        json_start = response.find("[")
+        json_end = response.rfind("]") + 1
+        if json_start >= 0 and json_end > json_start:
+            json_text = response[json_start:json_end]
+            tags = json.loads(json_text)
+            return tags if isinstance(tags, list) else []
+        else:
+            # Fallback: extract words that look like tags
+            words = [word.strip() for word in response.split() if len(word) > 3]
+            return words[:10]  # Return up to 10 words as tags
+    except json.JSONDecodeError:
+        return []
 
 
 def default_analysis_result():
@@ -131,33 +368,113 @@ def default_analysis_result():
     }
 
 
+def wrap_tags(result):
+    # Wrap tags in object if it's just a list
+    if isinstance(result, list):
+        return {"tags": result}
+    return result
+
+
+def run_operation(service, operation, texts, batch_size=DEFAULT_BATCH_SIZE):
+    operations = {
+        'summarize': service.summarize_batch,
+        'analyze': service.analyze_batch,
+        'tags': service.generate_tags_batch
+    }
+    if operation not in operations:
+        raise ValueError(f"Unknown operation: {operation}")
+    
+    results = operations[operation](texts, batch_size=batch_size)
+    if operation == 'tags':
+        results = [wrap_tags(r) for r in results]
+    return results
+
+
+def serve(service, batch_size=DEFAULT_BATCH_SIZE):
+    # Load the model once up front; each request then only pays for
+    # tokenize -> generate -> decode. Requests and responses are one JSON
+    # object per line: {"id", "operation", "text" | "texts"} -> {"id", "result" | "error"},
+    # preceded by a single {"ready": true} once the model is loaded
+    service.load_model()
+    print("Worker ready", file=sys.stderr)
+    # The caller only starts sending (and timing) requests after this line
+    sys.stdout.write(json.dumps({"ready": True}) + "\n")
+    sys.stdout.flush()
+    
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            if "texts" in request:
+                result = run_operation(service, request["operation"], request["texts"], batch_size)
+            else:
+                result = run_operation(service, request["operation"], [request["text"]])[0]
+            response = {"id": request_id, "result": result}
+        except Exception as e:
+            print(f"Request {request_id} failed: {e}", file=sys.stderr)
+            response = {"id": request_id, "error": str(e)}
+        
+        sys.stdout.write(json.dumps(response, ensure_ascii=False) + "\n")
+        sys.stdout.flush()
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='DeepSeek AI Service')
-    parser.add_argument('--operation', type=str, required=True, choices=['summarize', 'analyze', 'tags'], 
+    parser.add_argument('--operation', type=str, choices=['summarize', 'analyze', 'tags'], 
                         help='Operation to perform')
-    parser.add_argument('--input', type=str, required=True, help='Input text file path')
-    parser.add_argument('--output', type=str, required=True, help='Output JSON file path')
+    parser.add_argument('--input', type=str, help='Input text file path')
+    parser.add_argument('--output', type=str, help='Output JSON file path')
     parser.add_argument('--model', type=str, default="deepseek-ai/deepseek-coder-1.3b-instruct", 
                         help='Model name or path')
+    parser.add_argument('--quantization', type=str, choices=QUANTIZATION_MODES,
+                        default=os.environ.get('DOCUMIND_AI_QUANTIZATION', 'none'),
+                        help='Weight quantization applied at load time')
+    parser.add_argument('--compile', action='store_true',
+                        default=os.environ.get('DOCUMIND_AI_COMPILE', '').lower() in ('1', 'true', 'yes'),
+                        help='Compile the decoding step with torch.compile after loading')
+    parser.add_argument('--batch', action='store_true',
+                        help='Treat input as a JSON list of texts (or an object of id -> text)')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='Number of documents per forward pass in batch mode')
+    parser.add_argument('--serve', action='store_true',
+                        help='Run as a persistent worker reading JSON requests from stdin')
     
     args = parser.parse_args()
+    if not args.serve and not (args.operation and args.input and args.output):
+        parser.error('--operation, --input and --output are required unless --serve is given')
     
-    service = DeepSeekService(model_name=args.model)
-    
-    # Read input text
-    with open(args.input, 'r', encoding='utf-8') as f:
-        text = f.read()
-    
-    # Process based on operation
-    if args.operation == 'summarize':
-        result = service.summarize(text)
-    elif args.operation == 'analyze':
-        result = service.analyze(text)
-    elif args.operation == 'tags':
-        result = service.generate_tags(text)
-        # Wrap tags in object if it's just a list
-        if isinstance(result, list):
-            result = {"tags": result}
+    service = DeepSeekService(
+        model_name=args.model,
+        quantization=args.quantization,
+        compile=args.compile,
+        warmup_batch_size=args.batch_size if args.batch else 1
+    )
+    
+    if args.serve:
+        serve(service, batch_size=args.batch_size)
+        sys.exit(0)
+    
+    if args.batch:
+        # Read input documents, same format as the clustering input file
+        with open(args.input, 'r', encoding='utf-8') as f:
+            docs = json.load(f)
+        
+        doc_ids = list(docs.keys()) if isinstance(docs, dict) else None
+        texts = [docs[doc_id] for doc_id in doc_ids] if doc_ids is not None else docs
+        
+        results = run_operation(service, args.operation, texts, batch_size=args.batch_size)
+        result = dict(zip(doc_ids, results)) if doc_ids is not None else results
+    else:
+        # Read input text
+        with open(args.input, 'r', encoding='utf-8') as f:
+            text = f.read()
+        
+        result = run_operation(service, args.operation, [text])[0]
     
     # Write results to output file
     with open(args.output, 'w', encoding='utf-8') as f:
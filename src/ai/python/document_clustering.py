@@ -4,16 +4,25 @@ Uses scikit-learn to cluster documents based on TF-IDF vectorization
 """
 
 import os
+import re
 import sys
 import json
 import uuid
 import argparse
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.cluster import KMeans, DBSCAN
-from sklearn.decomposition import TruncatedSVD
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction import text
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dump_json_bytes(obj):
+    """Serialize with orjson when installed, otherwise the standard library"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode('utf-8')
+
 
 # Parse command line arguments
 parser = argparse.ArgumentParser(description='Cluster documents using NLP')
@@ -21,8 +30,35 @@ parser.add_argument('--input', required=True, help='Input JSON file with documen
 parser.add_argument('--output', required=True, help='Output JSON file for clustering results')
 parser.add_argument('--method', default='kmeans', help='Clustering method: kmeans or dbscan')
 parser.add_argument('--max_clusters', type=int, default=10, help='Maximum number of clusters')
+parser.add_argument('--exact', action='store_true',
+                    help='Always use full-batch KMeans instead of MiniBatchKMeans on large corpora')
+parser.add_argument('--hashing', action='store_true',
+                    help='Use a stateless HashingVectorizer on very large corpora (disables keywords)')
+parser.add_argument('--gpu', action='store_true',
+                    default=os.environ.get('DOCUMIND_CLUSTERING_GPU', '').lower() in ('1', 'true', 'yes'),
+                    help='Run scikit-learn estimators on the GPU through cuML when available')
 args = parser.parse_args()
 
+# cuML's accelerator has to be installed before scikit-learn is imported so
+# the estimators below transparently dispatch to their GPU implementations
+if args.gpu:
+    try:
+        import cuml.accel
+        cuml.accel.install()
+        print("Using cuML GPU acceleration", file=sys.stderr)
+    except ImportError:
+        print("cuML not available, falling back to scikit-learn on CPU", file=sys.stderr)
+    except Exception as e:
+        # Installed but unusable, e.g. no visible GPU or a CUDA mismatch
+        print(f"cuML acceleration failed ({e}), falling back to scikit-learn on CPU", file=sys.stderr)
+
+from sklearn.feature_extraction.text import TfidfVectorizer, HashingVectorizer, TfidfTransformer
+from sklearn.cluster import KMeans, MiniBatchKMeans, DBSCAN
+from sklearn.decomposition import TruncatedSVD
+from sklearn.feature_extraction import text
+from sklearn.preprocessing import normalize
+from joblib import Parallel, delayed
+
 # Load documents
 with open(args.input, 'r', encoding='utf-8') as f:
     doc_texts = json.load(f)
@@ -46,25 +82,84 @@ legal_stopwords = [
     'herein', 'thereof', 'hereby', 'wherefore', 'whatsoever', 'wheresoever',
     'therefrom', 'hereinafter', 'hereto', 'therein', 'aforesaid'
 ]
-stop_words = text.ENGLISH_STOP_WORDS.union(legal_stopwords)
-
-# Create TF-IDF vectorizer and transform documents
-vectorizer = TfidfVectorizer(
-    max_features=5000,
-    min_df=2,
-    max_df=0.85,
-    stop_words=stop_words,
-    ngram_range=(1, 2)
-)
-tfidf_matrix = vectorizer.fit_transform(texts)
+stop_words = frozenset(text.ENGLISH_STOP_WORDS.union(legal_stopwords))
+
+# Same tokens as TfidfVectorizer's default analyzer
+token_pattern = re.compile(r"(?u)\b\w\w+\b")
+
+# Tokenizing in worker processes only pays off past this many documents
+PARALLEL_TOKENIZE_MIN_DOCS = 200
+
+# Above this many documents K-means switches to mini-batch updates
+MINIBATCH_KMEANS_MIN_DOCS = 500
+
+# --hashing only kicks in from this many documents; below it building the
+# vocabulary is cheap and keeps cluster keywords available
+HASHING_MIN_DOCS = 10000
+
+
+def tokenize(doc):
+    """Lowercase, drop stopwords and emit unigrams + bigrams like TfidfVectorizer"""
+    tokens = [token for token in token_pattern.findall(doc.lower()) if token not in stop_words]
+    return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+
+def identity(tokens):
+    return tokens
+
+
+def top_k_indices(scores, k=10):
+    """Indices of the k largest scores along the last axis, highest first"""
+    k = min(k, scores.shape[-1])
+    top = np.argpartition(scores, -k, axis=-1)[..., -k:]
+    order = np.argsort(np.take_along_axis(scores, top, axis=-1), axis=-1)[..., ::-1]
+    return np.take_along_axis(top, order, axis=-1)
+
+
+# Pre-tokenize documents across CPU cores; the vectorizer then only counts
+if len(texts) >= PARALLEL_TOKENIZE_MIN_DOCS:
+    doc_tokens = Parallel(n_jobs=-1, backend='loky', batch_size='auto')(delayed(tokenize)(t) for t in texts)
+else:
+    doc_tokens = [tokenize(t) for t in texts]
+
+use_hashing = args.hashing and len(texts) >= HASHING_MIN_DOCS
+
+if use_hashing:
+    # One stateless pass: hash raw term counts into buckets, then weight them
+    # (hash collisions are accepted in exchange for skipping the vocabulary)
+    vectorizer = HashingVectorizer(
+        analyzer=identity,
+        lowercase=False,
+        n_features=2**18,
+        alternate_sign=False,
+        norm=None,
+        dtype=np.float32
+    )
+    tfidf_matrix = TfidfTransformer(sublinear_tf=True).fit_transform(vectorizer.transform(doc_tokens))
+else:
+    # Create TF-IDF vectorizer and transform documents
+    # (float32 halves the memory and bandwidth of the matrix for SVD/clustering)
+    vectorizer = TfidfVectorizer(
+        analyzer=identity,
+        lowercase=False,
+        max_features=5000,
+        min_df=2,
+        max_df=0.85,
+        dtype=np.float32,
+        sublinear_tf=True
+    )
+    tfidf_matrix = vectorizer.fit_transform(doc_tokens)
 
 # Apply dimensionality reduction if we have many documents
+svd = None
 if len(texts) > 20:
-    n_components = min(50, len(texts) - 1)
-    svd = TruncatedSVD(n_components=n_components)
-    normalized_matrix = svd.fit_transform(tfidf_matrix)
+    n_components = min(50, len(texts) - 1, tfidf_matrix.shape[1] - 1)
+    svd = TruncatedSVD(n_components=n_components, algorithm='randomized', n_iter=2, random_state=42)
+    # Unit rows make cosine similarity a plain inner product downstream
+    normalized_matrix = normalize(svd.fit_transform(tfidf_matrix), copy=False)
 else:
-    normalized_matrix = tfidf_matrix.toarray()
+    # Small corpora are clustered on the sparse TF-IDF rows directly
+    normalized_matrix = normalize(tfidf_matrix, copy=False)
 
 # Determine optimal number of clusters
 max_clusters = min(args.max_clusters, len(texts) // 2)
@@ -73,82 +168,90 @@ optimal_clusters = max(2, min(5, len(texts) // 5))  # Simple heuristic
 # Perform clustering
 if args.method == 'dbscan':
     # DBSCAN clustering (density-based)
-    clustering = DBSCAN(eps=0.5, min_samples=2).fit(normalized_matrix)
+    clustering = DBSCAN(eps=0.5, min_samples=2, metric='cosine').fit(normalized_matrix)
     labels = clustering.labels_
 else:
     # K-means clustering (default)
-    clustering = KMeans(n_clusters=optimal_clusters, random_state=42).fit(normalized_matrix)
+    if len(texts) > MINIBATCH_KMEANS_MIN_DOCS and not args.exact:
+        clustering = MiniBatchKMeans(n_clusters=optimal_clusters, random_state=42,
+                                     batch_size=1024, n_init='auto').fit(normalized_matrix)
+    else:
+        clustering = KMeans(n_clusters=optimal_clusters, random_state=42, algorithm='elkan').fit(normalized_matrix)
     labels = clustering.labels_
 
 # Extract keywords for each cluster
-feature_names = vectorizer.get_feature_names_out()
 cluster_keywords = {}
 
-# For K-means, we can use cluster centers
-if args.method != 'dbscan':
-    order_centroids = clustering.cluster_centers_.argsort()[:, ::-1]
+if use_hashing:
+    # Hashed buckets have no terms to name them
+    print("Hashing vectorizer in use, skipping cluster keywords", file=sys.stderr)
+elif args.method != 'dbscan':
+    # For K-means, we can use cluster centers
+    # Centers live in SVD space when the matrix was reduced; map them back
+    # to TF-IDF term weights before picking keywords
+    centers = clustering.cluster_centers_
+    if svd is not None:
+        centers = svd.inverse_transform(centers)
+    # One fancy-index maps every cluster's top terms to their names
+    feature_names = vectorizer.get_feature_names_out()
+    top_keywords = feature_names[top_k_indices(centers)].tolist()
     for cluster_idx in range(optimal_clusters):
-        top_keywords = [feature_names[i] for i in order_centroids[cluster_idx, :10]]
-        cluster_keywords[cluster_idx] = top_keywords
+        cluster_keywords[cluster_idx] = top_keywords[cluster_idx]
 else:
     # For DBSCAN, calculate most common terms in each cluster
+    feature_names = vectorizer.get_feature_names_out()
     for cluster_idx in set(labels):
         if cluster_idx == -1:  # Noise points
             continue
         
         cluster_docs = [i for i, label in enumerate(labels) if label == cluster_idx]
-        cluster_tfidf = tfidf_matrix[cluster_docs].toarray().sum(axis=0)
-        top_indices = cluster_tfidf.argsort()[-10:][::-1]
-        top_keywords = [feature_names[i] for i in top_indices]
+        cluster_tfidf = np.asarray(tfidf_matrix[cluster_docs].sum(axis=0)).ravel()
+        top_keywords = feature_names[top_k_indices(cluster_tfidf)].tolist()
         cluster_keywords[cluster_idx] = top_keywords
 
-# Calculate document similarities within clusters
-document_similarities = {}
-for i, doc_id in enumerate(doc_ids):
-    document_similarities[doc_id] = {}
-    for j, other_id in enumerate(doc_ids):
-        if i != j:
-            sim = cosine_similarity([normalized_matrix[i]], [normalized_matrix[j]])[0][0]
-            document_similarities[doc_id][other_id] = float(sim)
-
-# Prepare output structure
-clusters = []
-for cluster_idx in set(labels):
-    if cluster_idx == -1 and args.method == 'dbscan':  # Noise points in DBSCAN
-        continue
-    
-    cluster_docs = [(doc_id, i) for i, doc_id in enumerate(doc_ids) if labels[i] == cluster_idx]
+# Build clusters and stream each one to the output file as it is produced,
+# so only the current cluster's documents and similarities are held in memory
+cluster_count = 0
+with open(args.output, 'wb') as f:
+    f.write(b'{"clusters": [')
     
-    # Skip clusters with only one document
-    if len(cluster_docs) < 2:
-        continue
-    
-    # Calculate similarity to cluster centroid
-    documents = []
-    for doc_id, idx in cluster_docs:
-        # Calculate average similarity with other documents in cluster
-        similarities = [document_similarities[doc_id][other_id] for other_id, _ in cluster_docs if doc_id != other_id]
-        avg_similarity = sum(similarities) / len(similarities) if similarities else 0
+    for cluster_idx in set(labels):
+        if cluster_idx == -1 and args.method == 'dbscan':  # Noise points in DBSCAN
+            continue
         
-        documents.append({
-            "id": int(doc_id),
-            "similarity": round(avg_similarity, 3)
-        })
-    
-    # Create cluster info
-    cluster_info = {
-        "id": str(uuid.uuid4()),
-        "name": f"Document Cluster {len(clusters) + 1}",
-        "description": f"Group of {len(documents)} similar documents",
-        "keywords": cluster_keywords.get(cluster_idx, [])[:5],
-        "documents": sorted(documents, key=lambda x: x["similarity"], reverse=True)
-    }
+        idx = np.where(labels == cluster_idx)[0]
+        
+        # Skip clusters with only one document
+        if len(idx) < 2:
+            continue
+        
+        # Average similarity of each document with the other documents in its
+        # cluster; rows are unit-normalized, so cosine is a plain inner product
+        members = normalized_matrix[idx]
+        sub = members @ members.T
+        if hasattr(sub, 'toarray'):
+            sub = sub.toarray()
+        avg_similarities = (sub.sum(axis=1) - np.diag(sub)) / (len(idx) - 1)
+        
+        documents = [
+            {"id": int(doc_ids[i]), "similarity": round(float(avg_similarity), 3)}
+            for i, avg_similarity in zip(idx, avg_similarities)
+        ]
+        
+        # Create cluster info
+        cluster_info = {
+            "id": str(uuid.uuid4()),
+            "name": f"Document Cluster {cluster_count + 1}",
+            "description": f"Group of {len(documents)} similar documents",
+            "keywords": cluster_keywords.get(cluster_idx, [])[:5],
+            "documents": sorted(documents, key=lambda x: x["similarity"], reverse=True)
+        }
+        
+        if cluster_count:
+            f.write(b', ')
+        f.write(dump_json_bytes(cluster_info))
+        cluster_count += 1
     
-    clusters.append(cluster_info)
-
-# Write results to output file
-result = {"clusters": clusters}
-with open(args.output, 'w', encoding='utf-8') as f:
-    json.dump(result, f)
+    f.write(b']}')
 
-print(f"Clustering complete. Found {len(clusters)} clusters.")
+print(f"Clustering complete. Found {cluster_count} clusters.")
@@ -0,0 +1,117 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "ai", "python"))
+
+from deepseek_service import DeepSeekService  # noqa: E402
+
+PAD_ID = 0
+
+
+class CharTokenizer:
+    """One token per character; id 0 is both padding and EOS"""
+
+    pad_token = eos_token = "<pad>"
+    pad_token_id = eos_token_id = PAD_ID
+
+    def __init__(self):
+        self.padding_side = "right"
+
+    def __call__(self, prompts, return_tensors="pt", padding=True, truncation=True, pad_to_multiple_of=None):
+        rows = [[ord(char) for char in prompt] for prompt in prompts]
+        length = max(len(row) for row in rows)
+        if pad_to_multiple_of:
+            length = -(-length // pad_to_multiple_of) * pad_to_multiple_of
+        input_ids, attention_mask = [], []
+        for row in rows:
+            padding = [PAD_ID] * (length - len(row))
+            mask = [1] * len(row)
+            if self.padding_side == "left":
+                input_ids.append(padding + row)
+                attention_mask.append([0] * len(padding) + mask)
+            else:
+                input_ids.append(row + padding)
+                attention_mask.append(mask + [0] * len(padding))
+        return {"input_ids": torch.tensor(input_ids), "attention_mask": torch.tensor(attention_mask)}
+
+    def decode(self, token_ids, skip_special_tokens=False):
+        return "".join(chr(token_id) for token_id in token_ids if not (skip_special_tokens and token_id == PAD_ID))
+
+    def batch_decode(self, sequences, skip_special_tokens=False):
+        return [self.decode(row.tolist(), skip_special_tokens) for row in sequences]
+
+
+class EchoModel:
+    """Answers each row with respond(prompt), padding finished rows like generate() does"""
+
+    device = torch.device("cpu")
+    dtype = torch.float32
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.generation_config = SimpleNamespace(eos_token_id=PAD_ID)
+        self.calls = []
+
+    def generate(self, input_ids, attention_mask, **kwargs):
+        self.calls.append(input_ids.shape[0])
+        # Left padding means every row's prompt ends at the last column
+        assert attention_mask[:, -1].all()
+        prompts = [
+            "".join(chr(token_id) for token_id in row[mask.bool()].tolist())
+            for row, mask in zip(input_ids, attention_mask)
+        ]
+        answers = [[ord(char) for char in self.respond(prompt)] for prompt in prompts]
+        width = max(len(answer) for answer in answers)
+        generated = torch.tensor([answer + [PAD_ID] * (width - len(answer)) for answer in answers])
+        return torch.cat([input_ids, generated], dim=1)
+
+
+def make_service(respond):
+    service = DeepSeekService(model_name="stub")
+    service.tokenizer = CharTokenizer()
+    service.model = EchoModel(respond)
+    service.get_cache = lambda batch_size, max_cache_len: None
+    return service
+
+
+def document(prompt):
+    return prompt.split("Document content:\n", 1)[1].rsplit("\n\nResponse:", 1)[0]
+
+
+def test_rows_get_their_own_completion_with_uneven_prompts():
+    service = make_service(lambda prompt: f"<{prompt[::-1]}>")
+    prompts = ["a", "a much longer prompt", "mid length"]
+    assert service.generate_batch(prompts) == [f"<{prompt[::-1]}>" for prompt in prompts]
+    assert service.tokenizer.padding_side == "left"
+
+
+def test_completions_of_different_lengths_are_trimmed():
+    service = make_service(lambda prompt: "x" * len(prompt))
+    assert service.generate_batch(["abcdef", "ab"]) == ["xxxxxx", "xx"]
+
+
+def test_bucketed_padding_is_sliced_off():
+    # Compiled runs pad every prompt up to a CACHE_LEN_STEP bucket
+    service = make_service(lambda prompt: prompt.upper())
+    service.compile = True
+    assert service.generate_batch(["short", "longer one"]) == ["SHORT", "LONGER ONE"]
+
+
+def test_batches_are_chunked_by_batch_size_in_order():
+    service = make_service(lambda prompt: '{"summary": "%s", "keyPoints": []}' % document(prompt).upper())
+    texts = ["one", "the second text", "3", "four four", "fifth"]
+    results = service.summarize_batch(texts, batch_size=2)
+    assert service.model.calls == [2, 2, 1]
+    assert [result["summary"] for result in results] == [text.upper() for text in texts]
+
+
+def test_batch_size_below_one_runs_row_by_row():
+    service = make_service(lambda prompt: '["tag"]')
+    assert service.generate_tags_batch(["a", "b"], batch_size=0) == [["tag"], ["tag"]]
+    assert service.model.calls == [1, 1]
@@ -0,0 +1,88 @@
+import os
+import sys
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "ai", "python"))
+
+from deepseek_service import JsonBalanceStop  # noqa: E402
+
+PROMPT_LEN = 3
+
+
+class StubTokenizer:
+    """Maps each token id to a fixed piece of text"""
+
+    def __init__(self, pieces):
+        self.pieces = pieces
+
+    def decode(self, token_ids, skip_special_tokens=False):
+        return "".join(self.pieces[token_id] for token_id in token_ids)
+
+
+def run_rows(rows, kind="object"):
+    """Feed each row's pieces one token per step; return the done flags after every step"""
+    pieces = sorted({piece for row in rows for piece in row})
+    ids = {piece: i for i, piece in enumerate(pieces)}
+    stop = JsonBalanceStop(StubTokenizer(pieces), PROMPT_LEN, len(rows), kind=kind)
+
+    # Pad shorter rows by repeating their last piece, as generate keeps stepping
+    steps = max(len(row) for row in rows)
+    columns = [[ids[row[min(step, len(row) - 1)]] for row in rows] for step in range(steps)]
+
+    input_ids = torch.zeros((len(rows), PROMPT_LEN), dtype=torch.long)
+    history = []
+    for column in columns:
+        input_ids = torch.cat([input_ids, torch.tensor(column).unsqueeze(1)], dim=1)
+        history.append(stop(input_ids, None).tolist())
+    return history
+
+
+def test_stops_when_object_closes():
+    history = run_rows([["Sure: ", "{", '"a": 1', "}", " trailing"]])
+    assert [done[0] for done in history] == [False, False, False, True, True]
+
+
+def test_brace_inside_string_is_ignored():
+    history = run_rows([["{", '"text": "}', ' still open"', "}"]])
+    assert [done[0] for done in history] == [False, False, False, True]
+
+
+def test_escaped_quote_does_not_end_string():
+    history = run_rows([["{", '"a": "say \\"', '}"', "}"]])
+    assert [done[0] for done in history] == [False, False, False, True]
+
+
+def test_quotes_before_json_are_ignored():
+    history = run_rows([['He said "', "{", "}"]])
+    assert history[-1] == [True]
+
+
+def test_nested_object_waits_for_outer_close():
+    history = run_rows([["{", '"a": {', '"b": 1}', "}"]])
+    assert [done[0] for done in history] == [False, False, False, True]
+
+
+def test_array_kind_ignores_braces():
+    history = run_rows([["[", '{"tag": 1}', ', "b"', "]"]], kind="array")
+    assert [done[0] for done in history] == [False, False, False, True]
+
+
+def test_object_kind_ignores_brackets():
+    history = run_rows([["[", '"a"', "]"]], kind="object")
+    assert history[-1] == [False]
+
+
+def test_rows_complete_independently():
+    history = run_rows([
+        ["{", "}", "{"],
+        ["{", '"a": 1', ", "],
+        ["[", "{", "}"],
+    ])
+    assert history[0] == [False, False, False]
+    assert history[1] == [True, False, False]
+    # A finished row stays finished even if it opens another object
+    assert history[2] == [True, False, True]
@@ -0,0 +1,92 @@
+import io
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "ai", "python"))
+
+from deepseek_service import serve  # noqa: E402
+
+
+class StubService:
+    """Answers every operation from the text itself and records each batch it is given"""
+
+    def __init__(self):
+        self.loaded = False
+        self.batches = []
+
+    def load_model(self):
+        self.loaded = True
+
+    def summarize_batch(self, texts, batch_size):
+        self.batches.append((texts, batch_size))
+        return [{"summary": text.upper(), "keyPoints": []} for text in texts]
+
+    def analyze_batch(self, texts, batch_size):
+        self.batches.append((texts, batch_size))
+        return [{"topics": [text]} for text in texts]
+
+    def generate_tags_batch(self, texts, batch_size):
+        self.batches.append((texts, batch_size))
+        return [text.split() for text in texts]
+
+
+def run_serve(monkeypatch, lines, batch_size=4):
+    """Feed the lines to serve() and return the service and the parsed response lines"""
+    service = StubService()
+    stdout = io.StringIO()
+    monkeypatch.setattr(sys, "stdin", io.StringIO("".join(line + "\n" for line in lines)))
+    monkeypatch.setattr(sys, "stdout", stdout)
+    serve(service, batch_size=batch_size)
+    return service, [json.loads(line) for line in stdout.getvalue().splitlines()]
+
+
+def test_ready_is_sent_after_loading(monkeypatch):
+    service, responses = run_serve(monkeypatch, [])
+    assert service.loaded
+    assert responses == [{"ready": True}]
+
+
+def test_single_text_request(monkeypatch):
+    _, responses = run_serve(monkeypatch, [
+        json.dumps({"id": 1, "operation": "summarize", "text": "hello"}),
+        json.dumps({"id": 2, "operation": "tags", "text": "a b"}),
+    ])
+    assert responses[1:] == [
+        {"id": 1, "result": {"summary": "HELLO", "keyPoints": []}},
+        {"id": 2, "result": {"tags": ["a", "b"]}},
+    ]
+
+
+def test_texts_request_is_batched(monkeypatch):
+    service, responses = run_serve(monkeypatch, [
+        json.dumps({"id": 7, "operation": "analyze", "texts": ["x", "y", "z"]}),
+    ], batch_size=2)
+    assert responses[1:] == [{"id": 7, "result": [{"topics": ["x"]}, {"topics": ["y"]}, {"topics": ["z"]}]}]
+    assert service.batches == [(["x", "y", "z"], 2)]
+
+
+def test_unknown_operation_returns_error(monkeypatch):
+    _, responses = run_serve(monkeypatch, [
+        json.dumps({"id": 3, "operation": "translate", "text": "hola"}),
+        json.dumps({"id": 4, "operation": "summarize", "text": "still up"}),
+    ])
+    assert responses[1] == {"id": 3, "error": "Unknown operation: translate"}
+    assert responses[2] == {"id": 4, "result": {"summary": "STILL UP", "keyPoints": []}}
+
+
+def test_malformed_line_returns_error_and_keeps_serving(monkeypatch):
+    _, responses = run_serve(monkeypatch, [
+        "{not json",
+        "",
+        json.dumps({"id": 5, "operation": "summarize", "text": "ok"}),
+    ])
+    assert len(responses) == 3
+    assert responses[1]["id"] is None
+    assert "error" in responses[1]
+    assert responses[2] == {"id": 5, "result": {"summary": "OK", "keyPoints": []}}